@@ -1,12 +1,20 @@
 import requests
-import mysql.connector
+from requests.adapters import HTTPAdapter
+from mysql.connector import pooling
 from elasticsearch import Elasticsearch
-import json
+import orjson
 import os
+import sqlite3
 import time
+import threading
+import random
+import tempfile
+import gzip
 import logging
 from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from functools import lru_cache
 
 # Logger setup
 logger = logging.getLogger(__name__)
@@ -18,8 +26,21 @@ formatter = logging.Formatter(
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
-# Helper function to retry a function call every 5 sec up to 5 attempts.
-def retry(fn, attempts=5, delay=5):
+# Delay before the next retry: the server's Retry-After if it sent one,
+# otherwise capped exponential backoff with a little jitter. Both are kept
+# between 0 and `cap` seconds.
+def retryDelay(err, attempt, base, cap):
+    if isinstance(err, requests.HTTPError) and err.response is not None:
+        retryAfter = err.response.headers.get("Retry-After")
+        if retryAfter:
+            try:
+                return max(0.0, min(cap, float(retryAfter)))
+            except ValueError:
+                pass
+    return min(cap, base * 2 ** attempt) + random.random() * 0.25
+
+# Helper function to retry a function call up to 5 attempts with exponential backoff.
+def retry(fn, attempts=5, base=0.5, cap=30):
     last_error = None
     for i in range(attempts):
         try:
@@ -28,7 +49,8 @@ def retry(fn, attempts=5, delay=5):
             last_error = err
             logger.warning(f"Attempt {i + 1} failed: {err}")
             if i < attempts - 1:
-                logger.info(f"Retrying in {delay} seconds...")
+                delay = retryDelay(err, i, base, cap)
+                logger.info(f"Retrying in {delay:.1f} seconds...")
                 time.sleep(delay)
     logger.error(f"All {attempts} attempts failed: {last_error}")
     return None
@@ -41,120 +63,375 @@ mysqlConfig = {
     "password": "password",
     "database": "ncbi_virus",
 }
-es_client = Elasticsearch(["http://elasticsearch:9200"])
+# Local cache locations, created once at startup.
+CACHE_DIR = Path(os.getcwd()) / "cache"
+FASTA_CACHE_DIR = CACHE_DIR / "fasta"
+FASTA_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+# One-time migration of plain <uid>.fasta files written by older versions to
+# the gzip-compressed <uid>.fasta.gz format, so they are not downloaded again.
+def compressLegacyFastaCache():
+    for entry in os.scandir(FASTA_CACHE_DIR):
+        if not entry.name.endswith(".fasta"):
+            continue
+        try:
+            plainFile = Path(entry.path)
+            gzFile = plainFile.with_name(entry.name + ".gz")
+            if not gzFile.exists():
+                gzFile.write_bytes(gzip.compress(plainFile.read_bytes(), compresslevel=6))
+            plainFile.unlink()
+        except Exception as e:
+            logger.warning(f"Failed to compress legacy FASTA cache file {entry.path}: {e}")
+
+compressLegacyFastaCache()
+# uids with a cached FASTA file, from a single directory scan instead of a stat per uid.
+CACHED_FASTA = {
+    entry.name[:-len(".fasta.gz")] for entry in os.scandir(FASTA_CACHE_DIR) if entry.name.endswith(".fasta.gz")
+}
+# Number of IDs requested per esearch page (the esearch maximum).
+ESEARCH_PAGE_SIZE = 10000
+# Maximum number of IDs sent in a single esummary/efetch request.
+BATCH_SIZE = 200
+# Number of NCBI batches fetched concurrently. Concurrency alone does not cap
+# the request rate; waitForNcbiSlot() does that.
+MAX_CONCURRENT_REQUESTS = 3
+# NCBI allows 3 requests per second without an API key.
+NCBI_REQUESTS_PER_SECOND = 3
+# Maximum number of rows sent in a single multi-row MySQL statement. Kept well
+# below MYSQL_BULK_LOAD_THRESHOLD so executemany loads are split into several
+# batches that overlap with the ElasticSearch requests.
+MYSQL_BATCH_SIZE = 250
+# Row count from which loads go through LOAD DATA LOCAL INFILE instead of executemany.
+MYSQL_BULK_LOAD_THRESHOLD = 1000
+# Maximum number of documents and bytes sent in a single ElasticSearch bulk request.
+ES_BULK_CHUNK_SIZE = 500
+ES_BULK_MAX_BYTES = 10 * 1024 * 1024
+es_client = Elasticsearch(["http://elasticsearch:9200"], http_compress=True)
+
+# Shared HTTP session so all NCBI requests reuse pooled keep-alive connections.
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": "ETL/1.0"})
+SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=0))
+
+# Shared rate limiter for NCBI: spaces request starts at least
+# 1 / NCBI_REQUESTS_PER_SECOND seconds apart across all threads.
+ncbiRateLock = threading.Lock()
+ncbiNextRequest = 0.0
+
+def waitForNcbiSlot():
+    global ncbiNextRequest
+    with ncbiRateLock:
+        now = time.monotonic()
+        delay = ncbiNextRequest - now
+        ncbiNextRequest = max(now, ncbiNextRequest) + 1 / NCBI_REQUESTS_PER_SECOND
+    if delay > 0:
+        time.sleep(delay)
+
+# Open the metadata cache, a single SQLite database keyed by uid. The
+# connection is opened once and reused for the rest of the run.
+@lru_cache(maxsize=None)
+def openMetadataCache():
+    conn = sqlite3.connect(CACHE_DIR / "ncbi.db")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (uid TEXT PRIMARY KEY, json TEXT)")
+    importLegacyMetadataCache(conn)
+    return conn
+
+# One-time import of the old per-uid cache/metadata/<uid>.json files. The
+# directory is renamed afterwards so the import does not run again.
+def importLegacyMetadataCache(conn):
+    legacyDir = CACHE_DIR / "metadata"
+    if not legacyDir.is_dir():
+        return
+    try:
+        # Re-encode each file so only valid JSON (without the old whitespace)
+        # reaches the cache; files truncated by a crash are skipped.
+        rows = []
+        for path in legacyDir.glob("*.json"):
+            try:
+                rows.append((path.stem, orjson.dumps(orjson.loads(path.read_bytes()))))
+            except orjson.JSONDecodeError as e:
+                logger.warning(f"Skipping corrupt legacy cache file {path}: {e}")
+        conn.executemany("INSERT OR IGNORE INTO meta (uid, json) VALUES (?, ?)", rows)
+        conn.commit()
+        legacyDir.rename(CACHE_DIR / "metadata.imported")
+        logger.info(f"Imported {len(rows)} records from {legacyDir} into the metadata cache")
+    except Exception as e:
+        logger.warning(f"Failed to import legacy metadata cache from {legacyDir}: {e}")
+
+# In-memory tier in front of the metadata cache so repeated lookups of the
+# same uid within a run skip SQLite. Returns the record's JSON bytes, or None on a
+# miss. Rows that are not valid JSON are treated as misses so they are fetched
+# again instead of being passed on to MySQL and ElasticSearch.
+@lru_cache(maxsize=4096)
+def loadCachedMetadata(uid: str):
+    row = openMetadataCache().execute("SELECT json FROM meta WHERE uid = ?", (uid,)).fetchone()
+    if not row:
+        return None
+    data = row[0] if isinstance(row[0], bytes) else row[0].encode("utf-8")
+    try:
+        orjson.loads(data)
+    except orjson.JSONDecodeError as e:
+        logger.warning(f"Ignoring corrupt cache entry for ID {uid}: {e}")
+        return None
+    return data
+
+# Same for FASTA cache files; kept smaller since each entry holds a full sequence.
+# FASTA files are stored gzip-compressed.
+@lru_cache(maxsize=1024)
+def loadCachedFasta(uid: str):
+    if uid not in CACHED_FASTA:
+        return None
+    return gzip.decompress((FASTA_CACHE_DIR / f"{uid}.fasta.gz").read_bytes()).decode("utf-8")
 
 def fetchMetadata(query: str):
     searchUrl = NCBI_API + "esearch.fcgi"
-    searchParams = {
-        "db": "nuccore",
-        "term": query,
-        "retmode": "json",
-        "retmax": "1000",
-    }
-    completeSearchUrl = f"{searchUrl}?{urlencode(searchParams)}"
-    logger.info(f"NCBI Search URL: {completeSearchUrl}")
     logger.info("Making request to NCBI API for metadata search")
     
-    response = requests.get(searchUrl, params=searchParams)
-    searchResponse = response.json()
-    ids = searchResponse.get("esearchresult", {}).get("idlist", [])
+    # Page through the search results so queries with more than one page of
+    # matches are not truncated. The total comes from the first page.
+    ids = []
+    count = None
+    while count is None or len(ids) < count:
+        searchParams = {
+            "db": "nuccore",
+            "term": query,
+            "retmode": "json",
+            "retstart": str(len(ids)),
+            "retmax": str(ESEARCH_PAGE_SIZE),
+        }
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("NCBI Search URL: %s?%s", searchUrl, urlencode(searchParams))
+        
+        def fetch_search_page():
+            waitForNcbiSlot()
+            response = SESSION.get(searchUrl, params=searchParams)
+            response.raise_for_status()
+            searchResult = orjson.loads(response.content).get("esearchresult", {})
+            if "count" not in searchResult or "ERROR" in searchResult:
+                raise ValueError(f"esearch error: {searchResult.get('ERROR', 'no count in response')}")
+            return searchResult
+        
+        searchResult = retry(fetch_search_page, attempts=5)
+        if searchResult is None:
+            break
+        if count is None:
+            count = int(searchResult["count"])
+        pageIds = searchResult.get("idlist", [])
+        if not pageIds:
+            break
+        ids.extend(pageIds)
     if not ids:
         logger.warning("No IDs returned from NCBI search.")
-        return []
+        return {}
+    if len(ids) < count:
+        logger.warning(f"NCBI search returned only {len(ids)} of {count} IDs; continuing with a partial set")
+    else:
+        logger.info(f"NCBI search returned {len(ids)} of {count} IDs")
     
     summaryUrl = NCBI_API + "esummary.fcgi"
-    metadataCacheDir = Path(os.getcwd()) / "cache" / "metadata"
-    metadataCacheDir.mkdir(parents=True, exist_ok=True)
-    
-    records = []
+    # Deduplicate IDs up front so each uid is looked up, fetched and returned once.
+    uniqueIds = []
+    seen = set()
+    records = {}
+    missing = []
     for id_ in ids:
-        cacheFile = metadataCacheDir / f"{id_}.json"
-        record = None
-        if cacheFile.exists():
-            try:
-                with open(cacheFile, "r", encoding="utf-8") as f:
-                    record = json.load(f)
-            except Exception as e:
-                logger.warning(f"Failed to read cache for ID {id_}: {e}")
-        else:
-            summaryParams = {"db": "nuccore", "id": id_, "retmode": "json"}
-            completeSummaryUrl = f"{summaryUrl}?{urlencode(summaryParams)}"
-            logger.info(f"NCBI Summary URL for ID {id_}: {completeSummaryUrl}")
-            
-            def fetch_summary():
-                resp = requests.get(summaryUrl, params=summaryParams)
-                summaryResponse = resp.json()
-                return summaryResponse.get("result", {}).get(id_)
-            
-            record = retry(fetch_summary, attempts=5, delay=5)
+        if id_ in seen:
+            continue
+        seen.add(id_)
+        uniqueIds.append(id_)
+        try:
+            record = loadCachedMetadata(id_)
             if record:
-                logger.info(f"Fetched record for ID {id_}")
-                try:
-                    with open(cacheFile, "w", encoding="utf-8") as f:
-                        json.dump(record, f)
-                except Exception as e:
-                    logger.error(f"Error writing cache file for ID {id_}: {e}")
-            else:
-                logger.error(f"Failed to fetch metadata for ID {id_} after 5 attempts")
+                records[id_] = record
                 continue
-        if record:
-            records.append(record)
-    return records
-
-def fetchFasta(ids: list):
-    fastaCacheDir = Path(os.getcwd()) / "cache" / "fasta"
-    fastaCacheDir.mkdir(parents=True, exist_ok=True)
+        except Exception as e:
+            logger.warning(f"Failed to read cache for ID {id_}: {e}")
+        missing.append(id_)
+    
+    def fetch_summary_chunk(chunk):
+        summaryParams = {"db": "nuccore", "id": ",".join(chunk), "retmode": "json"}
+        logger.info("NCBI Summary request for %d IDs (%s ... %s)", len(chunk), chunk[0], chunk[-1])
+        
+        def fetch_summary():
+            waitForNcbiSlot()
+            resp = SESSION.post(summaryUrl, data=summaryParams)
+            resp.raise_for_status()
+            result = orjson.loads(resp.content).get("result", {})
+            result.pop("uids", None)
+            if not result:
+                raise ValueError("esummary response contained no records")
+            return result
+        
+        return retry(fetch_summary, attempts=5)
     
-    results = []
+    # Fetch all cache misses with one esummary POST per batch of IDs, keeping
+    # up to MAX_CONCURRENT_REQUESTS batches in flight.
+    cacheRows = []
+    chunks = [missing[start:start + BATCH_SIZE] for start in range(0, len(missing), BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        for chunk, result in zip(chunks, executor.map(fetch_summary_chunk, chunks)):
+            if not result:
+                logger.error(f"Failed to fetch metadata for {len(chunk)} IDs after 5 attempts")
+                continue
+            for uid, record in result.items():
+                if not record:
+                    continue
+                logger.info("Fetched record for ID %s", uid)
+                records[uid] = orjson.dumps(record)
+                cacheRows.append((uid, records[uid]))
+    
+    # Write all newly fetched records in one transaction.
+    if cacheRows:
+        try:
+            cacheConn = openMetadataCache()
+            cacheConn.executemany("INSERT OR REPLACE INTO meta (uid, json) VALUES (?, ?)", cacheRows)
+            cacheConn.commit()
+        except Exception as e:
+            logger.error(f"Error writing metadata cache: {e}")
+        loadCachedMetadata.cache_clear()
+    
+    for id_ in missing:
+        if id_ not in records:
+            logger.error(f"No metadata returned for ID {id_}")
+    return {id_: records[id_] for id_ in uniqueIds if id_ in records}
+
+# Split a multi-FASTA response into one entry per sequence, keyed by the
+# accession.version at the start of each header line.
+def splitFasta(text: str):
+    text = text.strip()
+    if not text.startswith(">"):
+        return {}
+    entries = [">" + entry.lstrip(">").strip() + "\n" for entry in text.split("\n>")]
+    return {entry[1:].split(None, 1)[0]: entry for entry in entries}
+
+def fetchFasta(metadata: dict):
+    fastaUrl = NCBI_API + "efetch.fcgi"
+    ids = list(metadata)
+    fastaMap = {}
+    missing = []
     for uid in ids:
-        cacheFile = fastaCacheDir / f"{uid}.fasta"
-        fasta = ""
-        if cacheFile.exists():
-            try:
-                with open(cacheFile, "r", encoding="utf-8") as f:
-                    fasta = f.read()
-            except Exception as e:
-                logger.warning(f"Failed to read cache for FASTA ID {uid}: {e}")
-        else:
-            fastaUrl = NCBI_API + "efetch.fcgi"
-            params = {
-                "db": "nuccore",
-                "id": uid,
-                "rettype": "fasta",
-                "retmode": "text",
-            }
-            completeFastaUrl = f"{fastaUrl}?{urlencode(params)}"
-            logger.info(f"NCBI FASTA URL for ID {uid}: {completeFastaUrl}")
-            
-            def fetch_fasta_func():
-                resp = requests.get(fastaUrl, params=params)
-                return resp.text
-            
-            fasta = retry(fetch_fasta_func, attempts=5, delay=5) or ""
+        try:
+            fasta = loadCachedFasta(uid)
             if fasta:
-                logger.info(f"Fetched FASTA for ID {uid}")
+                fastaMap[uid] = fasta
+                continue
+        except Exception as e:
+            logger.warning(f"Failed to read cache for FASTA ID {uid}: {e}")
+        missing.append(uid)
+    
+    # efetch headers carry the accession, not the uid, so entries are matched
+    # back to IDs through each record's esummary accessionversion.
+    accessions = {uid: orjson.loads(metadata[uid]).get("accessionversion") for uid in missing}
+    
+    # Returns the response's entries keyed by accession, or None if the request failed.
+    def fetch_fasta_chunk(chunk):
+        params = {
+            "db": "nuccore",
+            "id": ",".join(chunk),
+            "rettype": "fasta",
+            "retmode": "text",
+        }
+        logger.info("NCBI FASTA request for %d IDs (%s ... %s)", len(chunk), chunk[0], chunk[-1])
+        
+        def fetch_fasta_func():
+            waitForNcbiSlot()
+            resp = SESSION.post(fastaUrl, data=params)
+            resp.raise_for_status()
+            return resp.text
+        
+        text = retry(fetch_fasta_func, attempts=5)
+        return None if text is None else splitFasta(text)
+    
+    # Fetch a batch and match entries to IDs by accession. IDs the batch response
+    # did not cover are fetched individually; if the batch request itself failed,
+    # the chunk is skipped rather than retried one ID at a time.
+    def fetch_fasta_batch(chunk):
+        sequences = fetch_fasta_chunk(chunk)
+        if sequences is None:
+            logger.error(f"Failed to fetch FASTA for {len(chunk)} IDs after 5 attempts")
+            return {}
+        matched = {uid: sequences[accessions[uid]] for uid in chunk if accessions.get(uid) in sequences}
+        unmatched = [uid for uid in chunk if uid not in matched]
+        if unmatched and sequences and len(chunk) > 1:
+            logger.warning(f"Got no matching FASTA entry for {len(unmatched)} of {len(chunk)} IDs; fetching individually")
+            for uid in unmatched:
+                single = fetch_fasta_chunk([uid]) or {}
+                if accessions.get(uid) in single:
+                    matched[uid] = single[accessions[uid]]
+                elif accessions.get(uid) is None and len(single) == 1:
+                    matched[uid] = next(iter(single.values()))
+        return matched
+    
+    chunks = [missing[start:start + BATCH_SIZE] for start in range(0, len(missing), BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        for sequences in executor.map(fetch_fasta_batch, chunks):
+            for uid, fasta in sequences.items():
+                logger.info("Fetched FASTA for ID %s", uid)
+                fastaMap[uid] = fasta
                 try:
-                    with open(cacheFile, "w", encoding="utf-8") as f:
-                        f.write(fasta)
+                    cacheFile = FASTA_CACHE_DIR / f"{uid}.fasta.gz"
+                    cacheFile.write_bytes(gzip.compress(fasta.encode("utf-8"), compresslevel=6))
+                    CACHED_FASTA.add(uid)
                 except Exception as e:
                     logger.error(f"Error writing FASTA cache for ID {uid}: {e}")
-            else:
-                logger.warning(f"Failed to fetch FASTA for ID {uid} after 5 attempts; using empty FASTA.")
-        results.append({"uid": uid, "fasta": fasta})
-    return results
-
-def deduplicate(metadata: list):
-    unique = {}
-    for record in metadata:
-        uid = record.get("uid")
-        if uid:
-            unique[uid] = record
-    return list(unique.values())
-
-def loadToMySQLFull(metadata: list, fastaData: list):
-    logger.info("Loading data to MySQL")
+    if missing:
+        loadCachedFasta.cache_clear()
+    
+    for uid in ids:
+        if not fastaMap.get(uid):
+            logger.warning(f"Failed to fetch FASTA for ID {uid} after 5 attempts; using empty FASTA.")
+            fastaMap[uid] = ""
+    return fastaMap
+
+# Escape a value for LOAD DATA's default format (tab-separated, backslash escapes, \N for NULL).
+def toMySQLTsvField(value):
+    if value is None:
+        return "\\N"
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+        .replace("\0", "\\0")
+    )
+
+# Format one row as a line of LOAD DATA input.
+def toMySQLTsvLine(row):
+    return "\t".join(toMySQLTsvField(value) for value in row) + "\n"
+
+# Load a TSV file through a temporary staging table filled by LOAD DATA LOCAL
+# INFILE, then merge the staging table into ncbi_records in a single statement.
+def bulkLoadToMySQL(cursor, path: str):
+    cursor.execute("DROP TEMPORARY TABLE IF EXISTS ncbi_records_stage")
+    cursor.execute("CREATE TEMPORARY TABLE ncbi_records_stage LIKE ncbi_records")
+    cursor.execute(
+        f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE ncbi_records_stage "
+        "CHARACTER SET utf8mb4 (uid, metadata, fasta)"
+    )
+    cursor.execute("REPLACE INTO ncbi_records SELECT * FROM ncbi_records_stage")
+    cursor.execute("DROP TEMPORARY TABLE ncbi_records_stage")
+
+# MySQL connection pool, created on first use so importing the module does not
+# need a running server. Closing a pooled connection returns it to the pool.
+@lru_cache(maxsize=None)
+def getMySQLPool():
+    return pooling.MySQLConnectionPool(
+        pool_name="ncbi",
+        pool_size=4,
+        autocommit=False,
+        use_pure=False,
+        allow_local_infile_in_path=tempfile.gettempdir(),
+        **mysqlConfig,
+    )
+
+# Take a connection from the pool and make sure the target table exists. On
+# failure the connection is returned to the pool before the error propagates.
+def openMySQL():
+    conn = getMySQLPool().get_connection()
+    cursor = None
     try:
-        conn = mysql.connector.connect(**mysqlConfig)
         cursor = conn.cursor()
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS ncbi_records (
@@ -164,64 +441,192 @@ def loadToMySQLFull(metadata: list, fastaData: list):
             )
         """)
         conn.commit()
-        # Map FASTA data by uid
-        fastaMap = {item["uid"]: item["fasta"] for item in fastaData}
-        for record in metadata:
-            uid = record.get("uid")
-            fasta = fastaMap.get(uid)
-            query = "REPLACE INTO ncbi_records (uid, metadata, fasta) VALUES (%s, %s, %s)"
-            cursor.execute(query, (uid, json.dumps(record), fasta))
-        conn.commit()
-    except Exception as e:
-        logger.error(f"MySQL error: {e}")
-    finally:
-        cursor.close()
+    except Exception:
+        closeMySQL(conn, cursor, rollback=True)
+        raise
+    return conn, cursor
+
+# Release a MySQL connection, optionally rolling back first. Errors are only
+# logged, since the connection may already be gone.
+def closeMySQL(conn, cursor, rollback=False):
+    try:
+        if rollback:
+            conn.rollback()
+        if cursor is not None:
+            cursor.close()
         conn.close()
+    except Exception as e:
+        logger.warning(f"Error closing MySQL connection: {e}")
+
+# executemany turns the batch into one multi-row REPLACE; batches of
+# MYSQL_BATCH_SIZE keep the statement below max_allowed_packet.
+def writeToMySQL(cursor, rows: list):
+    query = "REPLACE INTO ncbi_records (uid, metadata, fasta) VALUES (%s, %s, %s)"
+    cursor.executemany(query, rows)
 
-def loadToElasticSearch(metadata: list, fastaData: list):
-    logger.info("Loading data to ElasticSearch")
+# Load records into MySQL and ElasticSearch in parallel: each sink has its own
+# background worker, and the main thread only builds the batches. Large loads
+# first write every MySQL row into one TSV and start loading it before any
+# ElasticSearch request goes out; smaller ones are flushed in executemany
+# batches (smaller than the bulk-load cutoff) during the ElasticSearch pass.
+# Metadata arrives as encoded JSON bytes and is passed through to both sinks
+# without being parsed again.
+def loadAll(metadata: dict, fastaMap: dict):
+    logger.info("Loading data to MySQL and ElasticSearch")
     indexName = "ncbi_records"
     
-    # Check if index exists; create it if it doesn't.
-    if not es_client.indices.exists(index=indexName):
-        es_client.indices.create(index=indexName)
-        logger.info(f"Created index {indexName} in ElasticSearch")
+    mysqlConn = None
+    try:
+        mysqlConn, cursor = openMySQL()
+    except Exception as e:
+        logger.error(f"MySQL error: {e}")
+    mysqlRows = []
+    # A single worker keeps the MySQL connection on one thread; waiting for the
+    # previous batch before submitting the next bounds memory to two batches.
+    mysqlExecutor = ThreadPoolExecutor(max_workers=1)
+    pendingWrite = None
     
-    logger.info("Indexing data to ElasticSearch")
-    fastaMap = {item["uid"]: item["fasta"] for item in fastaData}
+    def write_mysql(load, data):
+        nonlocal mysqlConn
+        if not mysqlConn:
+            return
+        try:
+            load(cursor, data)
+        except Exception as e:
+            logger.error(f"MySQL error: {e}")
+            closeMySQL(mysqlConn, cursor, rollback=True)
+            mysqlConn = None
     
-    bulk_ops = []
-    for record in metadata:
-        uid = record.get("uid")
+    def submit_mysql(load, data):
+        nonlocal pendingWrite
+        if pendingWrite:
+            pendingWrite.result()
+        pendingWrite = mysqlExecutor.submit(write_mysql, load, data)
+    
+    def flush_mysql():
+        nonlocal mysqlRows
+        if mysqlRows:
+            submit_mysql(writeToMySQL, mysqlRows)
+        mysqlRows = []
+    
+    # The JSON column rejects binary strings, so MySQL gets the decoded text.
+    def mysql_row(uid, metadataJson):
+        return (uid, metadataJson.decode("utf-8"), fastaMap.get(uid))
+    
+    tsvFile = None
+    if mysqlConn and len(metadata) >= MYSQL_BULK_LOAD_THRESHOLD:
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", newline="", suffix=".tsv", delete=False) as tsvFile:
+            for uid, metadataJson in metadata.items():
+                tsvFile.write(toMySQLTsvLine(mysql_row(uid, metadataJson)))
+        logger.info(f"Bulk loading {len(metadata)} rows to MySQL from {tsvFile.name}")
+        submit_mysql(bulkLoadToMySQL, tsvFile.name)
+    
+    esEnabled = True
+    try:
+        # Check if index exists; create it if it doesn't.
+        if not es_client.indices.exists(index=indexName):
+            es_client.indices.create(index=indexName)
+            logger.info(f"Created index {indexName} in ElasticSearch")
+    except Exception as e:
+        logger.error(f"ElasticSearch error: {e}")
+        esEnabled = False
+    esLines = []
+    esBytes = 0
+    esFailed = 0
+    # ElasticSearch requests get their own worker too, bounded the same way,
+    # so neither sink waits for the other.
+    esExecutor = ThreadPoolExecutor(max_workers=1)
+    pendingBulk = None
+    
+    # Send entries as one preformatted NDJSON bulk request.
+    def send_es(lines):
+        nonlocal esEnabled, esFailed
+        if not esEnabled:
+            return
+        try:
+            response = es_client.bulk(body=b"".join(lines))
+            if response.get("errors"):
+                for item in response["items"]:
+                    error = item.get("index", {}).get("error")
+                    if error:
+                        esFailed += 1
+                        logger.error(f"Failed to index document in ElasticSearch: {error}")
+        except Exception as e:
+            logger.error(f"ElasticSearch error: {e}")
+            esEnabled = False
+    
+    def flush_es():
+        nonlocal esLines, esBytes, pendingBulk
+        if esEnabled and esLines:
+            if pendingBulk:
+                pendingBulk.result()
+            pendingBulk = esExecutor.submit(send_es, esLines)
+        esLines = []
+        esBytes = 0
+    
+    for uid, metadataJson in metadata.items():
         fasta = fastaMap.get(uid)
-        bulk_ops.append({"index": {"_index": indexName, "_id": uid}})
-        bulk_ops.append({"metadata": record, "fasta": fasta})
+        if not tsvFile:
+            mysqlRows.append(mysql_row(uid, metadataJson))
+            if len(mysqlRows) >= MYSQL_BATCH_SIZE:
+                flush_mysql()
+        
+        action = orjson.dumps({"index": {"_index": indexName, "_id": uid}}) + b"\n"
+        document = b'{"metadata":' + metadataJson + b',"fasta":' + orjson.dumps(fasta) + b"}\n"
+        entrySize = len(action) + len(document)
+        # Flush before appending so a request never exceeds ES_BULK_MAX_BYTES
+        # (a single oversized document is still sent on its own).
+        if esLines and esBytes + entrySize > ES_BULK_MAX_BYTES:
+            flush_es()
+        esLines.append(action + document)
+        esBytes += entrySize
+        if len(esLines) >= ES_BULK_CHUNK_SIZE:
+            flush_es()
+    flush_mysql()
+    flush_es()
     
-    if bulk_ops:
-        bulk_response = es_client.bulk(body=bulk_ops)
-        if bulk_response.get("errors"):
-            logger.error("Errors occurred during bulk insert to ElasticSearch")
-        else:
-            logger.info("Successfully loaded data to ElasticSearch")
+    try:
+        if pendingBulk:
+            pendingBulk.result()
+    except Exception as e:
+        logger.error(f"ElasticSearch error: {e}")
+    esExecutor.shutdown(wait=True)
+    if esEnabled and esFailed:
+        logger.error(f"Errors occurred during bulk insert to ElasticSearch ({esFailed} failed)")
+    elif esEnabled:
+        logger.info("Successfully loaded data to ElasticSearch")
+    
+    # Collect the last batch's outcome so an error in it is logged, not dropped.
+    try:
+        if pendingWrite:
+            pendingWrite.result()
+    except Exception as e:
+        logger.error(f"MySQL error: {e}")
+    mysqlExecutor.shutdown(wait=True)
+    if tsvFile:
+        os.remove(tsvFile.name)
+    if mysqlConn:
+        try:
+            mysqlConn.commit()
+            logger.info("Successfully loaded data to MySQL")
+        except Exception as e:
+            logger.error(f"MySQL error: {e}")
+        finally:
+            closeMySQL(mysqlConn, cursor)
 
 def main():
     logger.info("Starting ETL Pipeline")
     QUERY = '(SARS-CoV-2[Organism]) AND South Dakota[Location] AND ("2023/01/01"[PDAT]:"2023/03/31"[PDAT])'
     metadata = fetchMetadata(QUERY)
-    logger.info(f"Fetched {len(metadata)} metadata records")
+    logger.info(f"Fetched {len(metadata)} unique metadata records")
     if not metadata:
         logger.error("No metadata found, exiting...")
         return
     
-    uniqueMetadata = deduplicate(metadata)
-    ids = [item.get("uid") for item in uniqueMetadata if item.get("uid")]
-    logger.info(f"Deduplicated to {len(uniqueMetadata)} unique records")
-    
-    fastaData = fetchFasta(ids)
-    logger.info(f"FASTA data length: {len(fastaData)}")
+    fastaMap = fetchFasta(metadata)
+    logger.info(f"FASTA data length: {len(fastaMap)}")
     
-    loadToMySQLFull(uniqueMetadata, fastaData)
-    loadToElasticSearch(uniqueMetadata, fastaData)
+    loadAll(metadata, fastaMap)
     
     logger.info("ETL pipeline completed successfully!")
 
@@ -4,15 +4,18 @@ cd /app/cache
 
 mkdir -p /app/output
 
-for file in /app/cache/fasta/*.fasta; do
-    base_name=$(basename "$file" .fasta)
+for file in /app/cache/fasta/*.fasta.gz; do
+    base_name=$(basename "$file" .fasta.gz)
     output_file="/app/output/${base_name}.csv"
     if [ -f "$output_file" ]; then
         echo "Output file $output_file already exists. Skipping $file."
         continue
     fi
-    echo "Processing ${file%.fasta}"
-    pangolin --analysis-mode fast "$file" --outfile "$output_file" -t 8
+    echo "Processing ${file%.fasta.gz}"
+    fasta_file="/tmp/${base_name}.fasta"
+    gunzip -c "$file" > "$fasta_file"
+    pangolin --analysis-mode fast "$fasta_file" --outfile "$output_file" -t 8
+    rm -f "$fasta_file"
 done
 
 awk 'FNR==1 && NR!=1 { next; } { print; }' /app/output/*.csv > /app/output/combined.csv